@@ -10,7 +10,7 @@ import os
 from visa_stay_analyzer import analyze_visa_stays
 
 # South Korean airport codes
-KOREA_AIRPORTS = {
+KOREA_AIRPORTS = frozenset({
     'ICN',  # Incheon International Airport
     'GMP',  # Gimpo International Airport
     'CJU',  # Jeju International Airport
@@ -25,7 +25,7 @@ KOREA_AIRPORTS = {
     'HIN',  # Sacheon Airport
     'MWX',  # Muan International Airport
     'KAG',  # Gangneung Airport
-}
+})
 
 # South Korea visa-free stay rules
 WINDOW_DAYS = 180
@@ -6,252 +6,439 @@ Analyzes stays in a country based on Flighty export data and visa rules.
 
 import argparse
 import csv
+import io
+import re
 import sys
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Set
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from functools import cached_property, lru_cache
+from operator import attrgetter, itemgetter
+from typing import AbstractSet, Optional, Iterator, List, Dict, TextIO, Tuple
 
 
+@dataclass
+class Flight:
+    """A flight into or out of the analyzed country."""
+
+    __slots__ = ('flight', 'from_airport', 'to_airport', 'is_arrival', 'border_time')
+
+    flight: str
+    from_airport: str
+    to_airport: str
+    # False for departures from the country
+    is_arrival: bool
+    # Arrival time for arrivals, departure time for departures
+    border_time: Optional[datetime]
+
+
+@dataclass
+class Stay:
+    """A completed stay, from an entry flight to the following exit flight.
+
+    Flights keep full timestamps so same-day flights sort correctly; stays
+    only need calendar days, so entry/exit are plain dates.
+    """
+
+    __slots__ = ('entry', 'exit', 'entry_date', 'exit_date')
+
+    entry: Flight
+    exit: Flight
+    entry_date: date
+    exit_date: date
+
+
+@dataclass
+class StayHistory:
+    """All stays for a country, with derived data cached for the report functions."""
+
+    stays: List[Stay]
+
+    @cached_property
+    def entry_ords(self) -> List[int]:
+        """Stay entry dates as proleptic Gregorian day ordinals."""
+        return [stay.entry_date.toordinal() for stay in self.stays]
+
+    @cached_property
+    def exit_ords(self) -> List[int]:
+        """Stay exit dates as proleptic Gregorian day ordinals."""
+        return [stay.exit_date.toordinal() for stay in self.stays]
+
+
+# Common timestamp layouts, parsed without strptime:
+# YYYY-MM-DD[( |T)HH:MM:SS] and MM/DD/YYYY[ HH:MM:SS]
+_DATETIME_RE = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2}):(\d{2}))?'
+    r'|(\d{2})/(\d{2})/(\d{4})(?: (\d{2}):(\d{2}):(\d{2}))?'
+)
+
+# strptime fallbacks for values the regex does not cover, such as single-digit
+# months, keyed by (US-style slashes, has a time part)
+_FALLBACK_FORMATS = {
+    (False, True): '%Y-%m-%d %H:%M:%S',
+    (False, False): '%Y-%m-%d',
+    (True, True): '%m/%d/%Y %H:%M:%S',
+    (True, False): '%m/%d/%Y',
+}
+
+
+@lru_cache(maxsize=4096)
 def parse_datetime(date_str: str) -> Optional[datetime]:
     """Parse datetime from various formats in the CSV."""
     if not date_str:
         return None
 
-    try:
-        return datetime.fromisoformat(date_str.replace('T', ' '))
-    except (ValueError, AttributeError, TypeError):
-        pass  # Fall through to try other formats
-
-    formats = [
-        '%Y-%m-%d %H:%M:%S',
-        '%Y-%m-%d',
-        '%m/%d/%Y %H:%M:%S',
-        '%m/%d/%Y',
-    ]
-
-    for fmt in formats:
+    match = _DATETIME_RE.fullmatch(date_str)
+    if match:
+        groups = match.groups()
+        if groups[0]:
+            year, month, day, hour, minute, second = groups[:6]
+        else:
+            month, day, year, hour, minute, second = groups[6:]
         try:
-            return datetime.strptime(date_str, fmt)
+            return datetime(int(year), int(month), int(day),
+                            int(hour or 0), int(minute or 0), int(second or 0))
         except ValueError:
-            continue
+            return None  # Matched the layout but not a real date, e.g. month 13
 
-    return None
+    # Only attempt ISO parsing on strings that start like YYYY-MM-DD
+    if len(date_str) >= 10 and date_str[4] == '-':
+        try:
+            return datetime.fromisoformat(date_str)
+        except ValueError:
+            pass  # Fall through to try other formats
 
+    # Only one format can fit the separators in the string, so try just that one
+    fmt = _FALLBACK_FORMATS['/' in date_str, ':' in date_str]
+    try:
+        return datetime.strptime(date_str, fmt)
+    except ValueError:
+        return None
 
-def calculate_days_between(date1: Optional[datetime], date2: Optional[datetime]) -> int:
-    """Calculate days between two dates (inclusive).
 
-    Args:
-        date1: Start date (should be <= date2)
-        date2: End date (should be >= date1)
+# Columns pulled from each CSV row: the filter columns for every row, the
+# detail columns only for flights that cross the country's border
+_FILTER_COLUMNS = ('From', 'To', 'Canceled')
+_DETAIL_COLUMNS = ('Airline', 'Flight',
+                   'Gate Arrival (Actual)', 'Landing (Actual)',
+                   'Gate Departure (Actual)', 'Take off (Actual)')
 
-    Returns:
-        Number of calendar days from date1 to date2 (inclusive).
-        Returns 0 if either date is None or if date2 < date1.
-    """
-    if not date1 or not date2:
-        return 0
 
-    if date2 < date1:
-        return 0
+def _column_getter(header: List[str], columns: Tuple[str, ...]) -> itemgetter:
+    """Build an itemgetter that pulls the named columns out of a csv.reader row."""
+    missing = [name for name in columns if name not in header]
+    if missing:
+        raise ValueError(f"missing column(s): {', '.join(missing)}")
+    return itemgetter(*(header.index(name) for name in columns))
+
 
-    delta = (date2.date() - date1.date()).days + 1
-    return delta
+# Spellings of a true 'Canceled' value, matched without lowercasing each row
+_CANCELED_VALUES = frozenset(('true', 'True', 'TRUE'))
 
 
-def load_flights(csv_path: str, airport_codes: Set[str]) -> List[Dict]:
-    """Load and filter flights from the CSV file.
+def load_stays(csv_path: str, airport_codes: AbstractSet[str],
+               out: Optional[TextIO] = None) -> Tuple[List[Stay], int]:
+    """Load flights from the CSV file and pair them into stays.
 
     Args:
         csv_path: Path to Flighty CSV export
         airport_codes: Set of airport codes for the country to analyze
+        out: Stream error messages are written to (default: stdout)
 
     Returns:
-        List of flight dictionaries with entry/exit information
+        Tuple of (stays with entry and exit information, number of flights
+        to/from the country that were found)
     """
     flights = []
+    codes = frozenset(airport_codes)
 
     try:
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            # Resolve column positions once from the header instead of building
+            # a dict for every row
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if not header:
+                return [], 0  # Empty export: no flights, so no stays
+
+            filter_columns = _column_getter(header, _FILTER_COLUMNS)
+            detail_columns = _column_getter(header, _DETAIL_COLUMNS)
+
             for row in reader:
-                from_airport = row['From']
-                to_airport = row['To']
-                canceled = row['Canceled'].lower() == 'true'
+                if not row:
+                    continue  # Blank line
+
+                from_airport, to_airport, canceled = filter_columns(row)
 
-                if canceled:
+                # Only flights crossing the border matter: exactly one end in the
+                # country. Checked first since it rejects most rows in an export.
+                from_inside = from_airport in codes
+                to_inside = to_airport in codes
+                if from_inside == to_inside:
                     continue
 
-                is_arrival = to_airport in airport_codes and from_airport not in airport_codes
-                is_departure = from_airport in airport_codes and to_airport not in airport_codes
-
-                if is_arrival or is_departure:
-                    gate_arrival = parse_datetime(row['Gate Arrival (Actual)']) or parse_datetime(
-                        row['Landing (Actual)'])
-                    gate_departure = parse_datetime(row['Gate Departure (Actual)']) or parse_datetime(
-                        row['Take off (Actual)'])
-
-                    flights.append({
-                        'date': row['Date'],
-                        'flight': f"{row['Airline']} {row['Flight']}",
-                        'from': from_airport,
-                        'to': to_airport,
-                        'is_arrival': is_arrival,
-                        'is_departure': is_departure,
-                        'arrival_time': gate_arrival,
-                        'departure_time': gate_departure,
-                    })
+                if canceled in _CANCELED_VALUES:
+                    continue
+
+                (airline, flight_number, gate_arrival, landing,
+                 gate_departure, take_off) = detail_columns(row)
+
+                if to_inside:
+                    border_time = parse_datetime(gate_arrival) or parse_datetime(landing)
+                else:
+                    border_time = parse_datetime(gate_departure) or parse_datetime(take_off)
+
+                # A handful of airport codes repeat across every kept flight,
+                # so share one string object per code
+                flights.append(Flight(
+                    flight=f"{airline} {flight_number}",
+                    from_airport=sys.intern(from_airport),
+                    to_airport=sys.intern(to_airport),
+                    is_arrival=to_inside,
+                    border_time=border_time,
+                ))
     except FileNotFoundError:
-        print(f"Error: File not found: {csv_path}")
+        (out or sys.stdout).write(f"Error: File not found: {csv_path}\n")
         sys.exit(1)
     except Exception as e:
-        print(f"Error reading CSV file: {e}")
+        (out or sys.stdout).write(f"Error reading CSV file: {e}\n")
         sys.exit(1)
 
     # Sort by date
-    flights.sort(key=lambda x: x['arrival_time'] if x['is_arrival'] else x['departure_time'])
-
-    return flights
-
+    flights.sort(key=attrgetter('border_time'))
 
-def calculate_stays(flights: List[Dict]) -> List[Dict]:
-    """Calculate stays from flight entry/exit pairs.
-
-    Args:
-        flights: List of flight dictionaries
-
-    Returns:
-        List of stay dictionaries with entry and exit information
-    """
+    # Pair each departure with the most recent arrival before it
     stays = []
     current_entry = None
 
     for flight in flights:
-        if flight['is_arrival']:
+        if flight.is_arrival:
             current_entry = flight
-        elif flight['is_departure'] and current_entry:
-            stays.append({
-                'entry': current_entry,
-                'exit': flight,
-                'entry_date': current_entry['arrival_time'],
-                'exit_date': flight['departure_time'],
-            })
+        elif current_entry:
+            stays.append(Stay(
+                entry=current_entry,
+                exit=flight,
+                entry_date=current_entry.border_time.date(),
+                exit_date=flight.border_time.date(),
+            ))
             current_entry = None
 
-    return stays
+    return stays, len(flights)
+
+
+def _iter_window_days(entry_ords: List[int], exit_ords: List[int],
+                      window_start: int, window_end: int) -> Iterator[int]:
+    """Yield the days each stay spends within a time window, in stay order."""
+    for entry, exit_ in zip(entry_ords, exit_ords):
+        # Clamp the stay to the window; stays outside it contribute nothing
+        first = entry if entry > window_start else window_start
+        last = exit_ if exit_ < window_end else window_end
+        yield last - first + 1 if last >= first else 0
+
+
+def calculate_window_days_per_stay(entry_ords: List[int], exit_ords: List[int],
+                                   window_start: int, window_end: int) -> List[int]:
+    """Calculate days each stay spends within a time window.
 
+    Both ends are inclusive calendar days, so a stay entering on window_end
+    counts 1 day regardless of the time its flight landed.
 
-def calculate_days_in_window(stays: List[Dict], window_start: datetime, window_end: datetime) -> int:
+    Args:
+        entry_ords: Stay entry dates as day ordinals
+        exit_ords: Stay exit dates as day ordinals
+        window_start: Start of the time window as a day ordinal
+        window_end: End of the time window as a day ordinal
+
+    Returns:
+        Number of days in the window for each stay, in the same order
+    """
+    return list(_iter_window_days(entry_ords, exit_ords, window_start, window_end))
+
+
+def calculate_days_in_window(entry_ords: List[int], exit_ords: List[int],
+                             window_start: int, window_end: int) -> int:
     """Calculate total days spent in country within a time window.
 
     Args:
-        stays: List of stay dictionaries
-        window_start: Start of the time window
-        window_end: End of the time window
+        entry_ords: Stay entry dates as day ordinals
+        exit_ords: Stay exit dates as day ordinals
+        window_start: Start of the time window as a day ordinal
+        window_end: End of the time window as a day ordinal
 
     Returns:
         Total number of days in the window
     """
-    total_days = 0
+    # Summed straight from the generator, without building a per-stay list
+    return sum(_iter_window_days(entry_ords, exit_ords, window_start, window_end))
+
+
+def find_days_until_available(entry_ords: List[int], exit_ords: List[int], reference_ord: int,
+                              window_days: int, max_used_days: int,
+                              max_days_forward: int = 364) -> Optional[Tuple[int, int]]:
+    """Find the first future date when the rolling window drops to max_used_days.
+
+    The window total changes by at most a constant slope between stay boundaries,
+    so instead of re-counting every day we sweep over the dates where that slope
+    changes and solve each linear segment directly. Entry and exit days both
+    count in full, so a stay starting on a probed date uses a day on that date.
+
+    Args:
+        entry_ords: Stay entry dates as day ordinals
+        exit_ords: Stay exit dates as day ordinals
+        reference_ord: Day ordinal to search forward from
+        window_days: Size of rolling window
+        max_used_days: Highest window total that still allows the desired stay
+        max_days_forward: How many days ahead of reference_ord to search
+
+    Returns:
+        Tuple of (days from reference_ord, days used in window on that date),
+        or None if no such date exists within max_days_forward days.
+    """
+    first_day = reference_ord + 1
+    last_day = reference_ord + max_days_forward
 
-    for stay in stays:
-        # Clamp stay dates to the window boundaries
-        clamped_entry = max(stay['entry_date'], window_start)
-        clamped_exit = min(stay['exit_date'], window_end)
+    used = calculate_days_in_window(entry_ords, exit_ords, first_day - window_days + 1, first_day)
+    if used <= max_used_days:
+        return 1, used
 
-        # Only count if the stay overlaps with the window
-        if clamped_entry <= clamped_exit:
-            total_days += calculate_days_between(clamped_entry, clamped_exit)
+    # The total only falls while the window's trailing edge passes through a
+    # stay; if that never happens before last_day, there is nothing to sweep
+    if not any(entry + window_days <= last_day and exit_ + window_days > first_day
+               for entry, exit_ in zip(entry_ords, exit_ords)):
+        return None
+
+    # Moving the window forward one day adds the new leading day and drops the
+    # old trailing day, so each stay changes the day-to-day slope at 4 points.
+    slope = 0
+    slope_changes: Dict[int, int] = {}
+    for entry, exit_ in zip(entry_ords, exit_ords):
+        for day, delta in ((entry, 1), (exit_ + 1, -1),
+                           (entry + window_days, -1), (exit_ + window_days + 1, 1)):
+            if day <= first_day:
+                slope += delta
+            elif day <= last_day:
+                slope_changes[day] = slope_changes.get(day, 0) + delta
+
+    day = first_day
+    for next_day in sorted(slope_changes) + [last_day + 1]:
+        if slope < 0:
+            # First day in [day, next_day) where used + slope * n <= max_used_days
+            steps = -((used - max_used_days) // slope)
+            if day + steps < next_day:
+                return day + steps - first_day + 1, used + slope * steps
+        if next_day > last_day:
+            break
+
+        used += slope * (next_day - 1 - day)
+        slope += slope_changes[next_day]
+        used += slope
+        day = next_day
+        if used <= max_used_days:
+            return day - first_day + 1, used
 
-    return total_days
+    return None
 
 
-def print_stays_report(stays: List[Dict], window_start: datetime, reference_date: datetime,
-                       country_name: str) -> int:
+def print_stays_report(history: StayHistory, window_days_per_stay: List[int],
+                       window_start: date, reference_date: date,
+                       country_name: str, out: Optional[TextIO] = None) -> None:
     """Print detailed report of all stays.
 
-    Returns:
-        Total days spent in window across all stays.
+    The report is built in memory and written to out (default: stdout) with a
+    single write, rather than one print call per line.
+
+    Args:
+        history: Stays to report on
+        window_days_per_stay: Days each stay spends in the window, in stay order
+        window_start: Start of the rolling window
+        reference_date: End of the rolling window
+        country_name: Name of the country for display
+        out: Stream to write the report to (default: stdout)
     """
-    print(f"All {country_name} stays:")
-    print(f"{'=' * 70}")
+    buf = io.StringIO()
+    print(f"All {country_name} stays:", file=buf)
+    print(f"{'=' * 70}", file=buf)
 
-    total_days_in_window = 0
+    # Dates that do not change per stay are formatted once up front
+    window_start_str = window_start.isoformat()
+    reference_str = reference_date.isoformat()
 
-    for i, stay in enumerate(stays, 1):
-        entry_date = stay['entry_date']
-        exit_date = stay['exit_date']
-        entry_flight = stay['entry']
-        exit_flight = stay['exit']
+    # Day arithmetic and comparisons use ordinals; dates are only formatted
+    window_start_ord = window_start.toordinal()
+    reference_ord = reference_date.toordinal()
 
-        total_stay_days = calculate_days_between(entry_date, exit_date)
+    stay_rows = zip(history.stays, history.entry_ords, history.exit_ords, window_days_per_stay)
+    for i, (stay, entry_ord, exit_ord, days_in_window) in enumerate(stay_rows, 1):
+        entry_flight = stay.entry
+        exit_flight = stay.exit
 
-        # Clamp stay dates to the window boundaries
-        clamped_entry = max(entry_date, window_start)
-        clamped_exit = min(exit_date, reference_date)
-        days_in_window = 0
-        if clamped_entry <= clamped_exit:
-            days_in_window = calculate_days_between(clamped_entry, clamped_exit)
+        total_stay_days = max(0, exit_ord - entry_ord + 1)
+        exit_str = stay.exit_date.isoformat()
 
-        print(f"\nStay #{i}:")
-        print(f"  Entry:  {entry_date.strftime('%Y-%m-%d')} - {entry_flight['flight']} "
-              f"({entry_flight['from']} -> {entry_flight['to']})")
-        print(f"  Exit:   {exit_date.strftime('%Y-%m-%d')} - {exit_flight['flight']} "
-              f"({exit_flight['from']} -> {exit_flight['to']})")
-        print(f"  Total stay: {total_stay_days} days")
+        print(f"\nStay #{i}:", file=buf)
+        print(f"  Entry:  {stay.entry_date.isoformat()} - {entry_flight.flight} "
+              f"({entry_flight.from_airport} -> {entry_flight.to_airport})", file=buf)
+        print(f"  Exit:   {exit_str} - {exit_flight.flight} "
+              f"({exit_flight.from_airport} -> {exit_flight.to_airport})", file=buf)
+        print(f"  Total stay: {total_stay_days} days", file=buf)
 
         if days_in_window > 0:
-            total_days_in_window += days_in_window
-            if entry_date < window_start:
-                print(f"  Days in {window_start.strftime('%Y-%m-%d')} window: {days_in_window} days "
-                      f"(from {clamped_entry.strftime('%Y-%m-%d')} to {clamped_exit.strftime('%Y-%m-%d')})")
+            if entry_ord < window_start_ord:
+                clamped_exit_str = reference_str if exit_ord > reference_ord else exit_str
+                print(f"  Days in {window_start_str} window: {days_in_window} days "
+                      f"(from {window_start_str} to {clamped_exit_str})", file=buf)
             else:
-                print(f"  Days in window: {days_in_window} days")
+                print(f"  Days in window: {days_in_window} days", file=buf)
         else:
-            print(f"  Days in window: 0 days (outside window)")
+            print(f"  Days in window: 0 days (outside window)", file=buf)
 
-    return total_days_in_window
+    (out or sys.stdout).write(buf.getvalue())
 
 
 def print_summary(total_days_in_window: int, max_days_in_window: int,
-                  max_consecutive_days: Optional[int], reference_date: datetime,
-                  country_name: str) -> None:
+                  max_consecutive_days: Optional[int], reference_date: date,
+                  country_name: str, out: Optional[TextIO] = None) -> None:
     """Print summary of visa status."""
+    buf = io.StringIO()
     remaining_days = max_days_in_window - total_days_in_window
 
-    print(f"\n{'=' * 70}")
-    print(f"\nSUMMARY:")
-    print(f"{'=' * 70}")
-    print(f"Total days in {country_name} within rolling window: {total_days_in_window} days")
-    print(f"Maximum allowed days: {max_days_in_window} days")
-    print(f"Days remaining: {remaining_days} days")
+    print(f"\n{'=' * 70}", file=buf)
+    print(f"\nSUMMARY:", file=buf)
+    print(f"{'=' * 70}", file=buf)
+    print(f"Total days in {country_name} within rolling window: {total_days_in_window} days", file=buf)
+    print(f"Maximum allowed days: {max_days_in_window} days", file=buf)
+    print(f"Days remaining: {remaining_days} days", file=buf)
 
     if max_consecutive_days:
-        print(f"\nNote: Single stay cannot exceed {max_consecutive_days} days consecutively")
+        print(f"\nNote: Single stay cannot exceed {max_consecutive_days} days consecutively", file=buf)
 
     if total_days_in_window >= max_days_in_window:
-        print(f"\nYou have exhausted your {max_days_in_window}-day limit within the window.")
-        print(f"   You cannot enter {country_name} until some days expire from the window.")
+        print(f"\nYou have exhausted your {max_days_in_window}-day limit within the window.", file=buf)
+        print(f"   You cannot enter {country_name} until some days expire from the window.", file=buf)
+        (out or sys.stdout).write(buf.getvalue())
         return
 
     max_stay = min(remaining_days, max_consecutive_days) if max_consecutive_days else remaining_days
 
-    print(f"\nIf you fly to {country_name} today ({reference_date.strftime('%Y-%m-%d')}):")
-    print(f"   You can stay for up to {max_stay} days")
+    print(f"\nIf you fly to {country_name} today ({reference_date.isoformat()}):", file=buf)
+    print(f"   You can stay for up to {max_stay} days", file=buf)
 
     if max_consecutive_days:
         if max_stay == max_consecutive_days:
-            print(f"   (Limited by: {max_consecutive_days}-day consecutive stay rule)")
+            print(f"   (Limited by: {max_consecutive_days}-day consecutive stay rule)", file=buf)
         else:
-            print(f"   (Limited by: remaining days in window)")
+            print(f"   (Limited by: remaining days in window)", file=buf)
 
+    (out or sys.stdout).write(buf.getvalue())
 
-def print_future_availability(stays: List[Dict], reference_date: datetime, window_days: int,
+
+def print_future_availability(history: StayHistory, reference_date: date, window_days: int,
                               max_days_in_window: int, max_consecutive_days: Optional[int],
-                              total_days_in_window: int) -> None:
+                              total_days_in_window: int, out: Optional[TextIO] = None) -> None:
     """Print future availability for desired stay durations."""
-    print(f"\n{'=' * 70}")
-    print(f"\nFUTURE AVAILABILITY:")
-    print(f"{'=' * 70}")
+    buf = io.StringIO()
+    print(f"\n{'=' * 70}", file=buf)
+    print(f"\nFUTURE AVAILABILITY:", file=buf)
+    print(f"{'=' * 70}", file=buf)
 
     # Determine which stay durations to check based on consecutive day limit
     if max_consecutive_days and max_consecutive_days >= 60:
@@ -259,6 +446,8 @@ def print_future_availability(stays: List[Dict], reference_date: datetime, windo
     else:
         desired_stays = [30]
 
+    reference_ord = reference_date.toordinal()
+
     for desired_days in desired_stays:
         if max_consecutive_days and desired_days > max_consecutive_days:
             continue
@@ -266,35 +455,34 @@ def print_future_availability(stays: List[Dict], reference_date: datetime, windo
         max_used_days = max_days_in_window - desired_days
 
         if total_days_in_window <= max_used_days:
-            print(f"\nYou can already stay {desired_days} days today!")
+            print(f"\nYou can already stay {desired_days} days today!", file=buf)
             continue
 
         # Find the first future date when enough days will have expired
-        found_date = None
-        for days_forward in range(1, 365):
-            future_date = reference_date + timedelta(days=days_forward)
-            future_window_start = future_date - timedelta(days=window_days - 1)
-            future_days = calculate_days_in_window(stays, future_window_start, future_date)
+        result = find_days_until_available(history.entry_ords, history.exit_ords, reference_ord,
+                                           window_days, max_used_days)
+        if result is None:
+            print(f"\nCannot calculate date for {desired_days}-day stay within next year", file=buf)
+            continue
 
-            if future_days <= max_used_days:
-                available = max_days_in_window - future_days
-                limited_to = min(available, max_consecutive_days) if max_consecutive_days else available
+        days_forward, future_days = result
+        future_date = date.fromordinal(reference_ord + days_forward)
+        available = max_days_in_window - future_days
+        limited_to = min(available, max_consecutive_days) if max_consecutive_days else available
 
-                print(f"\nTo stay {desired_days} days:")
-                print(f"   Wait until: {future_date.strftime('%Y-%m-%d')} ({days_forward} days from today)")
-                print(f"   On that date, you will have used {future_days} days in the window")
-                print(f"   Available for stay: {available} days (limited to {limited_to} by consecutive rule)")
-                found_date = future_date
-                break
+        print(f"\nTo stay {desired_days} days:", file=buf)
+        print(f"   Wait until: {future_date.isoformat()} ({days_forward} days from today)", file=buf)
+        print(f"   On that date, you will have used {future_days} days in the window", file=buf)
+        print(f"   Available for stay: {available} days (limited to {limited_to} by consecutive rule)", file=buf)
 
-        if not found_date:
-            print(f"\nCannot calculate date for {desired_days}-day stay within next year")
+    (out or sys.stdout).write(buf.getvalue())
 
 
-def analyze_visa_stays(csv_path: str, airport_codes: Set[str], country_name: str,
+def analyze_visa_stays(csv_path: str, airport_codes: AbstractSet[str], country_name: str,
                        window_days: int, max_days_in_window: int,
                        max_consecutive_days: Optional[int] = None,
-                       reference_date: Optional[datetime] = None) -> None:
+                       reference_date: Optional[date] = None,
+                       out: Optional[TextIO] = None) -> None:
     """Main analysis function.
 
     Args:
@@ -305,35 +493,47 @@ def analyze_visa_stays(csv_path: str, airport_codes: Set[str], country_name: str
         max_days_in_window: Maximum days allowed in window (e.g., 90)
         max_consecutive_days: Maximum consecutive days per stay (optional)
         reference_date: Reference date for analysis (default: today)
+        out: Stream the report is written to (default: stdout)
     """
+    out = out or sys.stdout
     if reference_date is None:
-        reference_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        reference_date = date.today()
+    elif isinstance(reference_date, datetime):
+        reference_date = reference_date.date()
 
     window_start = reference_date - timedelta(days=window_days - 1)
-
-    print(f"Analyzing visa-free stays: {country_name}")
-    print(f"{'=' * 70}")
-    print(f"Reference date: {reference_date.strftime('%Y-%m-%d')}")
-    print(f"{window_days}-day window: {window_start.strftime('%Y-%m-%d')} to {reference_date.strftime('%Y-%m-%d')}")
-    print(f"\n{'=' * 70}\n")
-
-    flights = load_flights(csv_path, airport_codes)
-    if not flights:
-        print(f"No flights found to/from {country_name}")
+    reference_str = reference_date.isoformat()
+
+    # Written before loading so it precedes any CSV error message
+    out.write(f"Analyzing visa-free stays: {country_name}\n"
+              f"{'=' * 70}\n"
+              f"Reference date: {reference_str}\n"
+              f"{window_days}-day window: {window_start.isoformat()} to {reference_str}\n"
+              f"\n{'=' * 70}\n\n")
+
+    stays, flight_count = load_stays(csv_path, airport_codes, out)
+    if not flight_count:
+        out.write(f"No flights found to/from {country_name}\n")
         return
 
-    stays = calculate_stays(flights)
-    if not stays:
-        print(f"No completed stays found in {country_name}")
+    history = StayHistory(stays)
+    if not history.stays:
+        out.write(f"No completed stays found in {country_name}\n")
         return
 
-    total_days = print_stays_report(stays, window_start, reference_date, country_name)
+    # Per-stay window days are computed once and shared by the report and summary
+    window_days_per_stay = calculate_window_days_per_stay(
+        history.entry_ords, history.exit_ords, window_start.toordinal(), reference_date.toordinal())
+    total_days = sum(window_days_per_stay)
+
+    print_stays_report(history, window_days_per_stay, window_start, reference_date,
+                       country_name, out)
 
     print_summary(total_days, max_days_in_window, max_consecutive_days,
-                  reference_date, country_name)
+                  reference_date, country_name, out)
 
-    print_future_availability(stays, reference_date, window_days, max_days_in_window,
-                              max_consecutive_days, total_days)
+    print_future_availability(history, reference_date, window_days, max_days_in_window,
+                              max_consecutive_days, total_days, out)
 
 
 def main():
@@ -369,13 +569,13 @@ Examples:
     args = parser.parse_args()
 
     # Parse airport codes
-    airport_codes = set(code.strip().upper() for code in args.airports.split(','))
+    airport_codes = frozenset(code.strip().upper() for code in args.airports.split(','))
 
     # Parse reference date if provided
     reference_date = None
     if args.date:
         try:
-            reference_date = datetime.strptime(args.date, '%Y-%m-%d')
+            reference_date = datetime.strptime(args.date, '%Y-%m-%d').date()
         except ValueError:
             print(f"Error: Invalid date format. Use YYYY-MM-DD")
             sys.exit(1)